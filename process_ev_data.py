@@ -1,29 +1,87 @@
 import altair as alt
+import numpy as np
 import pandas as pd
+import contextlib
+import hashlib
+import importlib.util
 import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# columns read by the pipeline and their parse types
+DTYPES = {
+    'Station ID': str,
+    'Charger Type': 'category',
+    'Cost (USD/kWh)': 'float32',
+    'Usage Stats (avg users/day)': 'float32'
+}
+
+# pyarrow parses the CSV on multiple threads; fall back to the C parser without it.
+# pyarrow is stricter about malformed rows, see read_stations()
+CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+
+# cost bin edges (right-closed) and their axis labels for the heatmap;
+# there is no 0.10 edge, so the second bin spans 0.05–0.15
+COST_BINS = np.array([0, 0.05, 0.15, 0.20, 0.25, 0.30, 0.35, 0.40, 0.45, np.inf], dtype=np.float32)
+COST_LABELS = ['0–0.05', '0.05–0.15', '0.15–0.20', '0.20–0.25',
+               '0.25–0.30', '0.30–0.35', '0.35–0.40', '0.40–0.45', '0.45+']
+
+# generated specs keyed by data fingerprint, see spec_fingerprint()
+SPEC_CACHE_DIR = '.spec_cache'
 
 def create_detailed_heatmap(df):
-    bins = [0, 0.05, 0.15, 0.20, 0.25, 0.30, 0.35, 0.40, 0.45, float('inf')]
-    labels = ['0–0.05', '0.10–0.15', '0.15–0.20', '0.20–0.25', 
-              '0.25–0.30', '0.30–0.35', '0.35–0.40', '0.40–0.45', '0.45+']
-    
-    df['Cost_Range'] = pd.cut(
-        df['Cost (USD/kWh)'],
-        bins=bins,
-        labels=labels
-    )
+    # right-closed bin index per station, -1 or len(COST_LABELS) when out of range;
+    # float32 on both sides so edge values like 0.35 land in the same bin. This
+    # matches float64 binning for prices given to 6 decimals or fewer; a cost
+    # within ~1e-8 above an edge (e.g. 0.15000001) rounds onto it and falls
+    # into the lower bin
+    cost = df['Cost (USD/kWh)'].to_numpy(np.float32)
+    cost_codes = np.searchsorted(COST_BINS, cost, side='left') - 1
 
-    agg = df.groupby(['Cost_Range', 'Charger Type']).agg({
-        'Usage Stats (avg users/day)': 'mean',
-        'Station ID': 'count'
-    }).reset_index()
+    # mean usage and station count per (cost range, charger type) cell,
+    # computed with bincount over the combined codes
+    charger_codes, charger_types = pd.factorize(df['Charger Type'], sort=True)
+    n_cells = len(COST_LABELS) * len(charger_types)
+
+    valid = (cost_codes >= 0) & (cost_codes < len(COST_LABELS)) & (charger_codes >= 0)
+    codes = cost_codes[valid] * len(charger_types) + charger_codes[valid]
+    usage = df['Usage Stats (avg users/day)'].to_numpy(dtype=float)[valid]
+    # zero missing usage so the sum bincount takes all valid rows unmasked;
+    # the per-cell usage count is the row count minus the missing rows
+    missing_usage = np.isnan(usage)
+    usage[missing_usage] = 0
+
+    # 'Station ID' counts non-null IDs, matching groupby count()
+    missing_id = df['Station ID'].isna().to_numpy()[valid]
+
+    rows = np.bincount(codes, minlength=n_cells)
+    counts = rows - np.bincount(codes[missing_id], minlength=n_cells)
+    usage_sums = np.bincount(codes, weights=usage, minlength=n_cells)
+    usage_counts = rows - np.bincount(codes[missing_usage], minlength=n_cells)
+    with np.errstate(invalid='ignore'):
+        usage_means = usage_sums / usage_counts
+
+    cost_idx, charger_idx = np.divmod(np.arange(n_cells), len(charger_types))
+    agg = pd.DataFrame({
+        'Cost_Range': np.asarray(COST_LABELS)[cost_idx],
+        'Charger Type': np.asarray(charger_types)[charger_idx],
+        'Usage Stats (avg users/day)': usage_means,
+        'Station ID': counts
+    })
     agg = agg[agg['Station ID'] > 0]
 
-    base = alt.Chart(agg).encode(
+    # heatmap and text share agg through the layer so it is inlined only once
+    base = alt.Chart().encode(
         x=alt.X('Cost_Range:O',
                 title='Cost per kWh (USD)',
-                sort=['0–0.05', '0.10–0.15', '0.15–0.20', '0.20–0.25', 
-                      '0.25–0.30', '0.30–0.35', '0.35–0.40', '0.40–0.45', '0.45+'],
+                sort=COST_LABELS,
                 axis=alt.Axis(
                     labelAngle=45,
                     grid=False,
@@ -46,7 +104,7 @@ def create_detailed_heatmap(df):
             alt.Tooltip('Usage Stats (avg users/day):Q', title='Avg Daily Users', format='.1f'),
             alt.Tooltip('Station ID:Q', title='Number of Stations', format=',d')
         ]
-    ).interactive()
+    )
 
     heatmap = base.mark_rect(
         stroke='white',
@@ -95,7 +153,7 @@ def create_detailed_heatmap(df):
         text='text:N'
     )
 
-    chart = (heatmap + text + annotation_layer).properties(
+    chart = alt.layer(heatmap, text, annotation_layer, data=agg).properties(
         width=800,
         height=200,
         padding={'left': 50, 'right': 150, 'top': 60, 'bottom': 60}, 
@@ -123,7 +181,12 @@ def create_detailed_heatmap(df):
     return chart
 
 def create_distance_usage_scatter(df):
-    scatter = alt.Chart(df).mark_circle(opacity=0.6).encode(
+    # only inline the fields the chart encodes, not every station column; the
+    # station CSVs lack most of them, so keep whichever are present
+    columns = ['Station Name', 'City', 'Distance to City (miles)',
+               'Usage Stats (avg users/day)', 'Number of Parking Spots', 'Renewable Energy']
+
+    scatter = alt.Chart(df[df.columns.intersection(columns)]).mark_circle(opacity=0.6).encode(
         x=alt.X('Distance to City (miles):Q',
                 title='Distance to City (miles)',
                 scale=alt.Scale(zero=False),
@@ -178,18 +241,78 @@ def create_distance_usage_scatter(df):
 
     return scatter
 
+def spec_fingerprint(df):
+    # covers the data, this module's chart code and the Altair version,
+    # so editing any of them produces a new spec
+    h = hashlib.blake2b(digest_size=16)
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    h.update(Path(__file__).read_bytes())
+    h.update(alt.__version__.encode())
+    return h.hexdigest()
+
+def dumps_spec(spec):
+    # orjson is several times faster than the stdlib encoder on chart specs
+    if orjson is not None:
+        return orjson.dumps(spec)
+    return json.dumps(spec).encode()
+
+def cache_spec(heatmap_spec, cached_spec):
+    # best effort: heatmap_spec.json is already written, so cache problems are
+    # reported but never fail the run. Write to a temp file and rename, so an
+    # interrupted run never leaves a truncated entry that later runs would
+    # trust, then drop entries for older data
+    cache_dir = cached_spec.parent
+    tmp_path = None
+    try:
+        cache_dir.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as f:
+            tmp_path = Path(f.name)
+            f.write(heatmap_spec)
+        os.replace(tmp_path, cached_spec)
+    except OSError as e:
+        print(f"Could not update spec cache: {e}")
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                tmp_path.unlink(missing_ok=True)
+        return
+
+    for entry in cache_dir.glob('heatmap_spec.*.json'):
+        if entry != cached_spec:
+            with contextlib.suppress(OSError):
+                entry.unlink(missing_ok=True)
+
+def read_stations(data_file):
+    try:
+        return pd.read_csv(data_file, usecols=list(DTYPES), dtype=DTYPES, engine=CSV_ENGINE)
+    except pd.errors.ParserError:
+        # pyarrow rejects rows with missing fields that the C parser pads with NaN
+        if CSV_ENGINE == 'c':
+            raise
+        return pd.read_csv(data_file, usecols=list(DTYPES), dtype=DTYPES, engine='c')
+
 def process_ev_data(data_file):
     try:
-        df = pd.read_csv(data_file)
-        print(f"Initial data shape: {df.shape}\n")
+        df = read_stations(data_file)
+        initial_shape = df.shape
 
         df = df.drop_duplicates()
-        print(f"Shape after removing duplicates: {df.shape}\n")
+        # only the heatmap columns are loaded, and duplicates are judged on those
+        print(f"Initial data shape (heatmap columns only): {initial_shape}\n\n"
+              f"Shape after removing duplicates on those columns: {df.shape}\n")
+
+        cached_spec = Path(SPEC_CACHE_DIR) / f"heatmap_spec.{spec_fingerprint(df)}.json"
+        try:
+            shutil.copyfile(cached_spec, 'heatmap_spec.json')
+            print("\nData unchanged, reused cached visualization specifications")
+            return
+        except OSError:
+            # no usable cache entry (missing, or pruned by another run); rebuild
+            pass
 
         heatmap = create_detailed_heatmap(df)
-        heatmap_spec = heatmap.to_dict()
-        with open('heatmap_spec.json', 'w') as f:
-            json.dump(heatmap_spec, f)
+        heatmap_spec = dumps_spec(heatmap.to_dict())
+        Path('heatmap_spec.json').write_bytes(heatmap_spec)
+        cache_spec(heatmap_spec, cached_spec)
         
         print("\nVisualization specifications saved successfully")
         